@@ -6,13 +6,20 @@ to estimate the likelihood of structure destruction based on building characteri
 and location.
 """
 
+import threading
+import time
+from collections import OrderedDict
+from types import MappingProxyType
+
+import folium
 import streamlit as st
 import numpy as np
 from metaflow import Flow, namespace
+from scipy.spatial import cKDTree
 from streamlit_folium import st_folium
 
 # California counties with approximate centroid coordinates
-CALIFORNIA_COUNTIES = {
+CALIFORNIA_COUNTIES = MappingProxyType({
     "Alameda": (37.6017, -121.7195),
     "Amador": (38.4463, -120.6542),
     "Butte": (39.6670, -121.6008),
@@ -59,11 +66,16 @@ CALIFORNIA_COUNTIES = {
     "Ventura": (34.4583, -119.0322),
     "Yolo": (38.6864, -121.9018),
     "Yuba": (39.2678, -121.3500),
-}
+})
+
+# Column-wise view of the counties, sorted by name, built once at import
+_NAMES_SORTED = tuple(sorted(CALIFORNIA_COUNTIES))
+_LATLON = np.array([CALIFORNIA_COUNTIES[n] for n in _NAMES_SORTED], dtype=np.float64)
+_LA_INDEX = _NAMES_SORTED.index("Los Angeles")
 
 # Feature options based on training data
-FEATURE_OPTIONS = {
-    "structure_type": [
+FEATURE_OPTIONS = MappingProxyType({
+    "structure_type": (
         "Single Family Residence Single Story",
         "Single Family Residence Multi Story",
         "Mobile Home Single Wide",
@@ -81,8 +93,8 @@ FEATURE_OPTIONS = {
         "Church",
         "School",
         "Hospital",
-    ],
-    "structure_category": [
+    ),
+    "structure_category": (
         "Single Residence",
         "Multiple Residence",
         "Mixed Commercial/Residential",
@@ -90,8 +102,8 @@ FEATURE_OPTIONS = {
         "Other Minor Structure",
         "Infrastructure",
         "Agriculture",
-    ],
-    "roof_construction": [
+    ),
+    "roof_construction": (
         "Asphalt",
         "Metal",
         "Tile",
@@ -99,21 +111,21 @@ FEATURE_OPTIONS = {
         "Wood",
         "Other",
         "Unknown",
-    ],
-    "eaves": [
+    ),
+    "eaves": (
         "Enclosed",
         "Unenclosed",
         "No Eaves",
         "Unknown",
-    ],
-    "vent_screen": [
+    ),
+    "vent_screen": (
         'Mesh Screen <= 1/8"',
         'Mesh Screen > 1/8"',
         "Unscreened",
         "No Vents",
         "Unknown",
-    ],
-    "exterior_siding": [
+    ),
+    "exterior_siding": (
         "Stucco/Brick/Cement",
         "Ignition Resistant",
         "Wood",
@@ -122,43 +134,47 @@ FEATURE_OPTIONS = {
         "Combustible",
         "Other",
         "Unknown",
-    ],
-    "window_pane": [
+    ),
+    "window_pane": (
         "Multi Pane",
         "Single Pane",
         "Radiant Heat",
         "No Windows",
         "Unknown",
-    ],
-    "deck_on_grade": [
+    ),
+    "deck_on_grade": (
         "No Deck/Porch",
         "Wood",
         "Composite",
         "Masonry/Concrete",
         "Unknown",
-    ],
-    "deck_elevated": [
+    ),
+    "deck_elevated": (
         "No Deck/Porch",
         "Wood",
         "Composite",
         "Masonry/Concrete",
         "Unknown",
-    ],
-    "patio_cover": [
+    ),
+    "patio_cover": (
         "No Patio Cover/Carport",
         "Non Combustible",
         "Combustible",
         "Unknown",
-    ],
-    "fence_attached": [
+    ),
+    "fence_attached": (
         "No Fence",
         "Non Combustible",
         "Combustible",
         "Unknown",
-    ],
-}
+    ),
+})
+
+# Feature selectors are split evenly across two columns
+FEATURE_ITEMS = tuple(FEATURE_OPTIONS.items())
+HALF = len(FEATURE_ITEMS) // 2
 
-FEATURE_LABELS = {
+FEATURE_LABELS = MappingProxyType({
     "structure_type": "Structure Type",
     "structure_category": "Structure Category",
     "roof_construction": "Roof Construction",
@@ -170,7 +186,53 @@ FEATURE_LABELS = {
     "deck_elevated": "Deck/Porch Elevated",
     "patio_cover": "Patio Cover/Carport",
     "fence_attached": "Fence Attached",
-}
+})
+
+
+# Scenarios queued for speculative prediction are flushed through the model
+# together once this many are pending or the oldest has waited this long
+PENDING_MAX_SCENARIOS = 8
+PENDING_MAX_WAIT = 0.05  # seconds
+
+# Number of scenario predictions kept per model run, shared across sessions
+PREDICTION_CACHE_SIZE = 2048
+
+
+@st.cache_resource
+def county_tree():
+    """Build a KD-tree over the county centroids for map click lookups."""
+    return cKDTree(_LATLON)
+
+
+def make_predictor(load_sklearn_model, model_treelite=None):
+    """Return a function mapping encoded rows to destruction probabilities.
+
+    Prefers the Treelite copy of the model, whose compiled tree evaluator
+    avoids sklearn's per-call overhead, and falls back to the sklearn model.
+    The sklearn model is only loaded for the fallback, since unpickling it
+    requires a scikit-learn version compatible with the flow's.
+    """
+    if model_treelite is not None:
+        try:
+            import treelite
+
+            tl_model = treelite.Model.deserialize_bytes(model_treelite)
+            return lambda X: treelite.gtil.predict(tl_model, X).reshape(len(X), -1)[:, -1]
+        except Exception as e:
+            st.warning(f"Treelite model unavailable, using sklearn: {e}")
+    model = load_sklearn_model()
+    return lambda X: model.predict_proba(X)[:, 1]
+
+
+def encoder_classes(encoder):
+    """Return the ordered classes of a fitted encoder.
+
+    Encoders are pandas CategoricalDtypes; runs trained before that stored
+    sklearn LabelEncoders instead.
+    """
+    if hasattr(encoder, "categories"):
+        return encoder.categories
+    return encoder.classes_
 
 
 @st.cache_resource
@@ -183,73 +245,180 @@ def load_model():
 
         if run is None:
             st.error("No successful WildfireFlow run found. Please run the flow first.")
-            return None, None, None, None, None
+            return None, None, None, None, None, None
 
         train_step = run["train"].task
-        model = train_step.data.model
+        model_treelite = (
+            train_step.data.model_treelite if "model_treelite" in train_step else None
+        )
         encoders = train_step.data.encoders
         feature_cols = train_step.data.feature_cols
         auc_score = train_step.data.auc_score
         run_id = run.id
 
-        return model, encoders, feature_cols, auc_score, run_id
+        # Flatten the fitted encoders into plain dicts so encoding a scenario
+        # is a dict lookup per feature instead of an encoder.transform call
+        lookup = {
+            col: {v: i for i, v in enumerate(encoder_classes(enc))}
+            for col, enc in encoders.items()
+        }
+        # Values not seen during training map to "Unknown" if available,
+        # otherwise to the first class
+        fallback = {col: lookup[col].get("Unknown", 0) for col in lookup}
+
+        predictor = make_predictor(lambda: train_step.data.model, model_treelite)
+
+        return predictor, lookup, fallback, feature_cols, auc_score, run_id
     except Exception as e:
         st.error(f"Error loading model: {e}")
-        return None, None, None, None, None
+        return None, None, None, None, None, None
 
 
-def encode_feature(value, encoder, feature_name):
-    """Encode a feature value using the fitted encoder."""
-    try:
-        return encoder.transform([value])[0]
-    except ValueError:
-        # Value not seen during training, use "Unknown" if available
-        try:
-            return encoder.transform(["Unknown"])[0]
-        except ValueError:
-            # Fall back to first class
-            return 0
+def encode_feature(value, lookup, fallback):
+    """Encode a feature value using the precomputed encoder lookup."""
+    return lookup.get(value, fallback)
+
 
+def scenario_key(feature_cols, features):
+    """Return a hashable key identifying a scenario."""
+    return tuple(features.get(col, "Unknown") for col in feature_cols)
 
-def predict_destruction(model, encoders, feature_cols, features):
+
+def encode_row(lookup, fallback, feature_cols, features):
+    """Encode a scenario into a single model input row."""
+    return np.fromiter(
+        (
+            encode_feature(features.get(col, "Unknown"), lookup[col], fallback[col])
+            for col in feature_cols
+        ),
+        dtype=np.float32,
+        count=len(feature_cols),
+    )
+
+
+def predict_batch(predictor, lookup, fallback, feature_cols, scenarios):
+    """Predict destruction likelihood for several scenarios in one model call."""
+    X = np.vstack([encode_row(lookup, fallback, feature_cols, f) for f in scenarios])
+    return predictor(X)
+
+
+def predict_destruction(predictor, lookup, fallback, feature_cols, features):
     """Make a prediction using the model."""
-    encoded_features = []
-    for col in feature_cols:
-        value = features.get(col, "Unknown")
-        encoded = encode_feature(value, encoders[col], col)
-        encoded_features.append(encoded)
-
-    X = np.array([encoded_features])
-    proba = model.predict_proba(X)[0, 1]
-    return proba
+    return predict_batch(predictor, lookup, fallback, feature_cols, [features])[0]
+
+
+def queue_scenario(features):
+    """Queue a scenario for speculative prediction."""
+    pending = st.session_state.setdefault("pending", [])
+    if features in pending:
+        return
+    if not pending:
+        st.session_state["pending_since"] = time.monotonic()
+    pending.append(features.copy())
 
 
-def create_county_map(selected_county):
-    """Create an interactive California counties map."""
-    import folium
+def pending_ready():
+    """Whether the queued scenarios should be flushed through the model."""
+    pending = st.session_state.get("pending")
+    if not pending:
+        return False
+    waited = time.monotonic() - st.session_state["pending_since"]
+    return len(pending) >= PENDING_MAX_SCENARIOS or waited >= PENDING_MAX_WAIT
 
+
+@st.cache_resource
+def prediction_cache(run_id):
+    """Return the scenario predictions cache for a model run, and its lock.
+
+    Keyed by run ID so a newly trained model never serves stale predictions.
+    The cache is shared by every session's script thread, so all access goes
+    through the lock.
+    """
+    return OrderedDict(), threading.Lock()
+
+
+def cached_prediction(cache, key):
+    """Return the cached prediction for a scenario, or None if not scored."""
+    predictions, lock = cache
+    with lock:
+        proba = predictions.get(key)
+        if proba is not None:
+            predictions.move_to_end(key)
+    return proba
+
+
+def flush_pending(predictor, lookup, fallback, feature_cols, cache):
+    """Score all queued scenarios with a single model call."""
+    pending = st.session_state.get("pending")
+    if not pending:
+        return
+    probas = predict_batch(predictor, lookup, fallback, feature_cols, pending)
+    predictions, lock = cache
+    with lock:
+        for features, proba in zip(pending, probas):
+            key = scenario_key(feature_cols, features)
+            predictions[key] = float(proba)
+            predictions.move_to_end(key)
+        # Evict the least recently used predictions once the cache is full
+        while len(predictions) > PREDICTION_CACHE_SIZE:
+            predictions.popitem(last=False)
+    pending.clear()
+
+
+def base_county_map():
+    """Create the interactive California counties map shared by every county.
+
+    The selected county is drawn by a separate highlight layer, so the base
+    map is identical across reruns and is only sent to the browser once.
+    Built fresh on each call: st_folium attaches the highlight layer to the
+    map it is given, so a cached map would accumulate every highlight and
+    share them between sessions.
+    """
     # California center
     ca_center = [37.0, -119.5]
 
-    m = folium.Map(location=ca_center, zoom_start=6, tiles="cartodbpositron")
+    # Canvas rendering draws all markers into one element instead of one
+    # SVG node per marker
+    m = folium.Map(
+        location=ca_center,
+        zoom_start=6,
+        tiles="cartodbpositron",
+        prefer_canvas=True,
+    )
 
     # Add county markers
-    for county, (lat, lon) in CALIFORNIA_COUNTIES.items():
-        is_selected = county == selected_county
+    for county, (lat, lon) in zip(_NAMES_SORTED, _LATLON.tolist()):
         folium.CircleMarker(
             location=[lat, lon],
-            radius=12 if is_selected else 8,
+            radius=8,
             popup=county,
             tooltip=county,
-            color="#d62728" if is_selected else "#1f77b4",
+            color="#1f77b4",
             fill=True,
-            fillColor="#d62728" if is_selected else "#1f77b4",
-            fillOpacity=0.7 if is_selected else 0.4,
+            fillColor="#1f77b4",
+            fillOpacity=0.4,
         ).add_to(m)
 
     return m
 
 
+def county_highlight(selected_county):
+    """Create the layer marking the selected county on the base map."""
+    lat, lon = CALIFORNIA_COUNTIES[selected_county]
+    fg = folium.FeatureGroup(name="Selected county")
+    folium.CircleMarker(
+        location=[lat, lon],
+        radius=12,
+        popup=selected_county,
+        tooltip=selected_county,
+        color="#d62728",
+        fill=True,
+        fillColor="#d62728",
+        fillOpacity=0.7,
+    ).add_to(fg)
+    return fg
+
+
 def main():
     st.set_page_config(
         page_title="Wildfire Destruction Predictor",
@@ -265,9 +434,9 @@ def main():
     """)
 
     # Load model
-    model, encoders, feature_cols, auc_score, run_id = load_model()
+    predictor, lookup, fallback, feature_cols, auc_score, run_id = load_model()
 
-    if model is None:
+    if predictor is None:
         st.stop()
 
     # Display Run ID prominently
@@ -285,40 +454,35 @@ def main():
         # County dropdown (also selectable from map)
         selected_county = st.selectbox(
             "Choose a county:",
-            options=sorted(CALIFORNIA_COUNTIES.keys()),
-            index=sorted(CALIFORNIA_COUNTIES.keys()).index("Los Angeles"),
+            options=_NAMES_SORTED,
+            index=_LA_INDEX,
         )
 
-        # Interactive map
-        try:
-            m = create_county_map(selected_county)
-            map_data = st_folium(
-                m,
-                width=500,
-                height=400,
-                returned_objects=["last_object_clicked"],
-            )
+        # Interactive map; only the highlight layer changes with the county,
+        # so the base map is not re-sent on reruns. A fixed key keeps the same
+        # component instance, and only the clicked object is sent back to
+        # keep the payload small.
+        map_data = st_folium(
+            base_county_map(),
+            key="county_map",
+            feature_group_to_add=county_highlight(selected_county),
+            width=500,
+            height=400,
+            returned_objects=["last_object_clicked"],
+        )
 
-            # Update county if user clicked on map
-            if map_data and map_data.get("last_object_clicked"):
-                clicked = map_data["last_object_clicked"]
-                if clicked:
-                    # Find closest county to click
-                    click_lat = clicked.get("lat")
-                    click_lng = clicked.get("lng")
-                    if click_lat and click_lng:
-                        min_dist = float("inf")
-                        closest_county = selected_county
-                        for county, (lat, lon) in CALIFORNIA_COUNTIES.items():
-                            dist = (lat - click_lat) ** 2 + (lon - click_lng) ** 2
-                            if dist < min_dist:
-                                min_dist = dist
-                                closest_county = county
-                        if closest_county != selected_county and min_dist < 0.5:
-                            st.rerun()
-        except ImportError:
-            st.warning("Install `streamlit-folium` and `folium` for interactive map.")
-            st.info(f"Selected county: **{selected_county}**")
+        # Update county if user clicked on map
+        if map_data and map_data.get("last_object_clicked"):
+            clicked = map_data["last_object_clicked"]
+            if clicked:
+                # Find closest county to click
+                click_lat = clicked.get("lat")
+                click_lng = clicked.get("lng")
+                if click_lat and click_lng:
+                    dist, idx = county_tree().query((click_lat, click_lng))
+                    closest_county = _NAMES_SORTED[idx]
+                    if closest_county != selected_county and dist < 0.5**0.5:
+                        st.rerun()
 
     with col_features:
         st.subheader("Building Characteristics")
@@ -328,11 +492,8 @@ def main():
         # Create two columns for feature selection
         feat_col1, feat_col2 = st.columns(2)
 
-        feature_items = list(FEATURE_OPTIONS.items())
-        half = len(feature_items) // 2
-
         with feat_col1:
-            for feat_name, options in feature_items[:half]:
+            for feat_name, options in FEATURE_ITEMS[:HALF]:
                 features[feat_name] = st.selectbox(
                     FEATURE_LABELS[feat_name],
                     options=options,
@@ -340,19 +501,34 @@ def main():
                 )
 
         with feat_col2:
-            for feat_name, options in feature_items[half:]:
+            for feat_name, options in FEATURE_ITEMS[HALF:]:
                 features[feat_name] = st.selectbox(
                     FEATURE_LABELS[feat_name],
                     options=options,
                     key=feat_name,
                 )
 
+    # Speculatively score the scenario being edited so the Predict button is
+    # usually a lookup; queued scenarios share one model call
+    cache = prediction_cache(run_id)
+    key = scenario_key(feature_cols, features)
+    if cached_prediction(cache, key) is None:
+        queue_scenario(features)
+    if pending_ready():
+        flush_pending(predictor, lookup, fallback, feature_cols, cache)
+
     # Prediction section
     st.markdown("---")
 
     if st.button("Predict Destruction Likelihood", type="primary", use_container_width=True):
         with st.spinner("Calculating..."):
-            probability = predict_destruction(model, encoders, feature_cols, features)
+            flush_pending(predictor, lookup, fallback, feature_cols, cache)
+            probability = cached_prediction(cache, key)
+            if probability is None:
+                # Evicted by another session since it was scored
+                probability = predict_destruction(
+                    predictor, lookup, fallback, feature_cols, features
+                )
         st.session_state["prediction_result"] = probability
         st.session_state["prediction_features"] = features.copy()
 
@@ -3,6 +3,31 @@ import io
 
 from obproject import ProjectFlow
 
+# CSV columns read by each step; everything else is skipped at parse time
+CARD_COLUMNS = [
+    "Incident Start Date",
+    "* Incident Name",
+    "* Damage",
+    "County",
+    "Latitude",
+    "Longitude",
+]
+TRAIN_COLUMNS = [
+    "* Damage",
+    "* Structure Type",
+    "Structure Category",
+    "* Roof Construction",
+    "* Eaves",
+    "* Vent Screen",
+    "* Exterior Siding",
+    "* Window Pane",
+    "* Deck/Porch On Grade",
+    "* Deck/Porch Elevated",
+    "* Patio Cover/Carport Attached to Structure",
+    "* Fence Attached to Structure",
+    "County",
+]
+
 class WildfireFlow(ProjectFlow):
 
     wfdata = IncludeFile(
@@ -11,7 +36,10 @@ class WildfireFlow(ProjectFlow):
     map_template = IncludeFile("maptemplate", default="wildfire_map.html")
 
     @card(type="html")
-    @pypi(python="3.12", packages={"duckdb": "1.4.3", "pyarrow": "22.0.0"})
+    @pypi(
+        python="3.12",
+        packages={"duckdb": "1.4.3", "pyarrow": "22.0.0", "orjson": "3.10.12"},
+    )
     @step
     def start(self):
         import duckdb
@@ -19,7 +47,10 @@ class WildfireFlow(ProjectFlow):
         import pyarrow.csv as csv
         from wildfire_card import render_wildfire_card
 
-        table = csv.read_csv(pa.BufferReader(self.wfdata))
+        table = csv.read_csv(
+            pa.BufferReader(self.wfdata),
+            convert_options=csv.ConvertOptions(include_columns=CARD_COLUMNS),
+        )
         con = duckdb.connect()
         con.register("wildfires", table)
         self.html = render_wildfire_card(con, self.map_template)
@@ -33,26 +64,35 @@ class WildfireFlow(ProjectFlow):
             "pyarrow": "22.0.0",
             "scikit-learn": "1.6.1",
             "pandas": "2.2.3",
+            "treelite": "4.4.1",
         },
     )
     @step
     def train(self):
         import duckdb
         import pyarrow as pa
+        import pyarrow.compute as pc
         import pyarrow.csv as csv
+        import numpy as np
         import pandas as pd
         from sklearn.model_selection import train_test_split
-        from sklearn.ensemble import GradientBoostingClassifier
-        from sklearn.preprocessing import LabelEncoder
+        from sklearn.ensemble import HistGradientBoostingClassifier
+        from sklearn.inspection import permutation_importance
         from sklearn.metrics import roc_auc_score
+        import treelite
 
-        table = csv.read_csv(pa.BufferReader(self.wfdata))
+        table = csv.read_csv(
+            pa.BufferReader(self.wfdata),
+            convert_options=csv.ConvertOptions(include_columns=TRAIN_COLUMNS),
+        )
         con = duckdb.connect()
         con.register("wildfires", table)
 
-        # Select relevant features for prediction
-        df = con.execute(
+        # Select relevant features for prediction, with a binary target:
+        # 1 = destroyed, 0 = not destroyed
+        con.execute(
             """
+            CREATE VIEW features AS
             SELECT
                 "* Damage" as damage,
                 "* Structure Type" as structure_type,
@@ -66,14 +106,13 @@ class WildfireFlow(ProjectFlow):
                 "* Deck/Porch Elevated" as deck_elevated,
                 "* Patio Cover/Carport Attached to Structure" as patio_cover,
                 "* Fence Attached to Structure" as fence_attached,
-                County as county
+                County as county,
+                ("* Damage" = 'Destroyed (>50%)')::INTEGER as target
             FROM wildfires
             WHERE "* Damage" != 'Inaccessible'
         """
-        ).df()
-
-        # Create binary target: 1 = destroyed, 0 = not destroyed
-        df["target"] = (df["damage"] == "Destroyed (>50%)").astype(int)
+        )
+        data = con.execute("SELECT * FROM features").fetch_arrow_table()
 
         # Features to use for prediction
         feature_cols = [
@@ -91,24 +130,66 @@ class WildfireFlow(ProjectFlow):
             "county",
         ]
 
-        # Encode categorical features
-        encoders = {}
-        for col in feature_cols:
-            le = LabelEncoder()
-            df[col] = le.fit_transform(df[col].fillna("Unknown").astype(str))
-            encoders[col] = le
+        # Calculate destruction rate for each feature value, highest first.
+        # Unpivoting the feature columns lets one GROUP BY cover them all in
+        # a single scan.
+        feature_value_stats = {col: [] for col in feature_cols}
+        for col, value, destruction_rate, count in con.execute(
+            f"""
+            SELECT feature, value, AVG(target), COUNT(*)
+            FROM (
+                UNPIVOT features
+                ON {", ".join(feature_cols)}
+                INTO NAME feature VALUE value
+            )
+            GROUP BY feature, value
+            -- Filter to values with at least 20 samples for reliability
+            HAVING COUNT(*) >= 20
+            -- Keep the 10 values with the highest destruction rates
+            QUALIFY row_number() OVER (
+                PARTITION BY feature ORDER BY AVG(target) DESC, value
+            ) <= 10
+            ORDER BY feature, AVG(target) DESC, value
+        """
+        ).fetchall():
+            feature_value_stats[col].append(
+                {"value": value, "destruction_rate": destruction_rate, "count": count}
+            )
 
-        X = df[feature_cols]
-        y = df["target"]
+        y = data["target"].to_numpy()
 
         # Split data
-        X_train, X_test, y_train, y_test = train_test_split(
-            X, y, test_size=0.2, random_state=42, stratify=y
+        train_idx, test_idx = train_test_split(
+            np.arange(data.num_rows), test_size=0.2, random_state=42, stratify=y
         )
 
-        # Train gradient boosting classifier
-        model = GradientBoostingClassifier(
-            n_estimators=100, max_depth=5, random_state=42
+        # Encode categorical features using categories from the train split;
+        # values unseen there get code 255 (missing), and features with more
+        # than 255 categories are rejected
+        X = np.empty((data.num_rows, len(feature_cols)), dtype=np.uint8)
+        encoders = {}
+        for i, col in enumerate(feature_cols):
+            values = pc.fill_null(data[col], "Unknown")
+            categories = sorted(pc.unique(values.take(train_idx)).to_pylist())
+            if len(categories) > 255:
+                raise ValueError(
+                    f"Feature {col!r} has {len(categories)} categories; at most "
+                    "255 are supported"
+                )
+            encoders[col] = pd.CategoricalDtype(categories)
+            codes = pc.index_in(values, value_set=pa.array(categories))
+            X[:, i] = pc.fill_null(codes, 255).to_numpy()
+
+        X_train, X_test = X[train_idx], X[test_idx]
+        y_train, y_test = y[train_idx], y[test_idx]
+
+        # Train histogram gradient boosting classifier, treating every
+        # encoded feature as categorical
+        model = HistGradientBoostingClassifier(
+            max_iter=100,
+            max_depth=5,
+            categorical_features=list(range(len(feature_cols))),
+            random_state=42,
         )
         model.fit(X_train, y_train)
 
@@ -117,53 +198,35 @@ class WildfireFlow(ProjectFlow):
         self.auc_score = float(roc_auc_score(y_test, y_pred_proba))
         print(f"Model AUC Score: {self.auc_score:.4f}")
 
-        # Store feature importances
-        self.feature_importances = dict(zip(feature_cols, model.feature_importances_))
+        # Store feature importances; HistGradientBoostingClassifier has no
+        # impurity-based importances, so measure the drop in test AUC instead.
+        # One shuffle over a 2000-row sample keeps this well under a second
+        # and, on the bundled data, ranks the top features as the full test
+        # set does.
+        importances = permutation_importance(
+            model,
+            X_test,
+            y_test,
+            scoring="roc_auc",
+            n_repeats=1,
+            max_samples=2000,
+            n_jobs=-1,
+            random_state=42,
+        )
+        self.feature_importances = dict(
+            zip(feature_cols, importances.importances_mean.tolist())
+        )
         print("Feature Importances:")
         for feat, imp in sorted(self.feature_importances.items(), key=lambda x: -x[1]):
             print(f"  {feat}: {imp:.4f}")
 
         # Store model and encoders for inference
         self.model = model
+        # Treelite copy of the model for fast single-row inference in the app
+        self.model_treelite = treelite.sklearn.import_model(model).serialize_bytes()
         self.encoders = encoders
         self.feature_cols = feature_cols
 
-        # Compute destruction rates by feature value (using original data)
-        df_orig = con.execute(
-            """
-            SELECT
-                "* Damage" as damage,
-                "* Structure Type" as structure_type,
-                "Structure Category" as structure_category,
-                "* Roof Construction" as roof_construction,
-                "* Eaves" as eaves,
-                "* Vent Screen" as vent_screen,
-                "* Exterior Siding" as exterior_siding,
-                "* Window Pane" as window_pane,
-                "* Deck/Porch On Grade" as deck_on_grade,
-                "* Deck/Porch Elevated" as deck_elevated,
-                "* Patio Cover/Carport Attached to Structure" as patio_cover,
-                "* Fence Attached to Structure" as fence_attached,
-                County as county
-            FROM wildfires
-            WHERE "* Damage" != 'Inaccessible'
-        """
-        ).df()
-        df_orig["target"] = (df_orig["damage"] == "Destroyed (>50%)").astype(int)
-
-        # Calculate destruction rate for each feature value
-        feature_value_stats = {}
-        for col in feature_cols:
-            stats = (
-                df_orig.groupby(col)
-                .agg(destruction_rate=("target", "mean"), count=("target", "count"))
-                .reset_index()
-            )
-            stats.columns = ["value", "destruction_rate", "count"]
-            # Filter to values with at least 20 samples for reliability
-            stats = stats[stats["count"] >= 20]
-            feature_value_stats[col] = stats.to_dict("records")
-
         # Render feature importance card
         from train_card import render_feature_importance_card
 
@@ -60,17 +60,15 @@ def render_feature_importance_card(feature_importances, auc_score, feature_value
             if not stats:
                 continue
 
-            # Sort by destruction rate and get top values
-            sorted_stats = sorted(stats, key=lambda x: -x['destruction_rate'])
-
-            # Prepare chart data - show all values for comparison
+            # Prepare chart data - stats hold the top 10 values, highest
+            # destruction rate first
             chart_data = [
                 {
                     "value": str(s['value'])[:25],  # Truncate long names
                     "destruction_rate": round(s['destruction_rate'] * 100, 1),
                     "count": s['count']
                 }
-                for s in sorted_stats[:10]  # Top 10 values
+                for s in stats
             ]
 
             feat_display = feat_name.replace('_', ' ').title()
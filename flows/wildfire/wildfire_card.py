@@ -1,59 +1,105 @@
-import json
-from collections import defaultdict
+import orjson
+
+# Grid cell sizes (degrees) incidents are clustered into, keyed by the lowest
+# map zoom level at which that grid is shown
+CELL_SIZES = {0: 0.25, 9: 0.02}
 
 
 def render_wildfire_card(con, template):
     from metaflow.plugins.cards.card_modules import chevron
 
-    # Query all incidents with location data
-    result = con.execute("""
+    # All incidents with location data, by month
+    # Date format is "MM-DD-YYYY HH:MM"; rows with unparseable dates are skipped
+    con.execute("""
+        CREATE TEMP VIEW incidents AS
+        SELECT *
+        FROM (
+            SELECT
+                strftime(
+                    try_strptime(split_part("Incident Start Date", ' ', 1), '%m-%d-%Y'),
+                    '%Y-%m'
+                ) as month,
+                "* Incident Name" as incident_name,
+                "* Damage" as damage,
+                County as county,
+                Latitude as lat,
+                Longitude as lon
+            FROM wildfires
+            WHERE Latitude IS NOT NULL
+              AND Longitude IS NOT NULL
+              AND Latitude != 0
+              AND Longitude != 0
+        )
+        WHERE month IS NOT NULL
+    """)
+
+    # Monthly totals shown above the map
+    months = {
+        month: {
+            'incidents': incidents,
+            'destroyed': destroyed,
+            'counties': counties,
+            'cells': {zoom: [] for zoom in CELL_SIZES},
+        }
+        for month, incidents, destroyed, counties in con.execute("""
+            SELECT
+                month,
+                count(*),
+                count(*) FILTER (WHERE damage LIKE '%Destroyed%'),
+                count(DISTINCT county)
+            FROM incidents
+            GROUP BY month
+        """).fetchall()
+    }
+
+    # Cluster incidents into grid cells at every zoom level in one scan, so
+    # the card ships one marker per cell instead of one per incident
+    levels = ", ".join(f"({zoom}, {size})" for zoom, size in CELL_SIZES.items())
+    result = con.execute(f"""
         SELECT
-            "Incident Start Date" as date,
-            "* Incident Name" as incident_name,
-            "* Damage" as damage,
-            County as county,
-            Latitude as lat,
-            Longitude as lon
-        FROM wildfires
-        WHERE Latitude IS NOT NULL
-          AND Longitude IS NOT NULL
-          AND Latitude != 0
-          AND Longitude != 0
-        ORDER BY "Incident Start Date"
+            month,
+            zoom,
+            list({{
+                'lat': lat,
+                'lon': lon,
+                'count': count,
+                'destroyed': destroyed,
+                'damage': damage,
+                'incident_name': incident_name,
+                'county': county
+            }}) as cells
+        FROM (
+            SELECT
+                month,
+                zoom,
+                round(avg(lat), 5) as lat,
+                round(avg(lon), 5) as lon,
+                count(*) as count,
+                count(*) FILTER (WHERE damage LIKE '%Destroyed%') as destroyed,
+                mode(damage) as damage,
+                mode(incident_name) as incident_name,
+                mode(county) as county
+            FROM incidents
+            CROSS JOIN (VALUES {levels}) as levels(zoom, size)
+            GROUP BY month, zoom, floor(lat / size), floor(lon / size)
+        )
+        GROUP BY month, zoom
     """).fetchall()
 
-    # Group incidents by month
-    incidents_by_month = defaultdict(list)
-
-    for row in result:
-        date_str, incident_name, damage, county, lat, lon = row
-
-        # Parse date - format is "MM-DD-YYYY HH:MM"
-        if date_str:
-            try:
-                parts = date_str.split()[0].split('-')
-                if len(parts) == 3:
-                    month, day, year = parts
-                    month_key = f"{year}-{month.zfill(2)}"
-
-                    incidents_by_month[month_key].append({
-                        'date': date_str.split()[0],
-                        'incident_name': incident_name,
-                        'damage': damage,
-                        'county': county,
-                        'lat': lat,
-                        'lon': lon
-                    })
-            except (ValueError, IndexError):
-                continue
+    for month, zoom, cells in result:
+        months[month]['cells'][zoom] = cells
 
     data = {
-        'incidents_by_month': dict(incidents_by_month)
+        'zoom_levels': list(CELL_SIZES),
+        'months': months,
     }
 
     html = chevron.render(
         template,
-        dict(data=json.dumps(data), title="California Wildfire Incidents")
+        dict(
+            data=orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode(),
+            title="California Wildfire Incidents",
+        )
     )
 
     return html